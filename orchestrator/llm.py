@@ -6,16 +6,93 @@ Supports OpenAI and Anthropic APIs
 import os
 import json
 import re
-from typing import Dict, Any, Optional
+import asyncio
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
 import tiktoken
 from openai import AsyncOpenAI
 from anthropic import AsyncAnthropic
 
 
+_TEMPLATE_RE = re.compile(r'\{\{([^}]+)\}\}')
+
+# Process-wide caps on concurrent upstream requests, to stay within provider rate limits
+_OPENAI_SEM = asyncio.Semaphore(int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")))
+_ANTHROPIC_SEM = asyncio.Semaphore(int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "16")))
+
+
+@lru_cache(maxsize=1024)
+def _split_path(var: str) -> Tuple[str, ...]:
+    """Split a dotted template variable into its keys"""
+    return tuple(var.split("."))
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    """Load a tiktoken encoding once per process and share it across providers"""
+    return tiktoken.encoding_for_model(model)
+
+
+# Token counts keyed on (model, content hash), evicted least-recently-used first
+_TOKEN_COUNT_CACHE: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+_TOKEN_COUNT_CACHE_SIZE = 4096
+
+# Long texts are counted in chunks so no single token list grows with the input
+_COUNT_CHUNK_CHARS = 64_000
+
+
+def _text_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+def _get_cached_count(key: Tuple[str, bytes]) -> Optional[int]:
+    count = _TOKEN_COUNT_CACHE.get(key)
+    if count is not None:
+        _TOKEN_COUNT_CACHE.move_to_end(key)
+    return count
+
+
+def _store_count(key: Tuple[str, bytes], count: int) -> int:
+    _TOKEN_COUNT_CACHE[key] = count
+    if len(_TOKEN_COUNT_CACHE) > _TOKEN_COUNT_CACHE_SIZE:
+        _TOKEN_COUNT_CACHE.popitem(last=False)
+    return count
+
+
+def _count_ordinary_tokens(encoding: tiktoken.Encoding, text: str) -> int:
+    """Count tokens without special-token handling, chunking long inputs on line breaks"""
+    if len(text) <= _COUNT_CHUNK_CHARS:
+        return len(encoding.encode_ordinary(text))
+    
+    count = 0
+    start = 0
+    while start < len(text):
+        end = min(start + _COUNT_CHUNK_CHARS, len(text))
+        if end < len(text):
+            split = text.rfind("\n", start, end)
+            if split > start:
+                end = split
+        count += len(encoding.encode_ordinary(text[start:end]))
+        start = end
+    return count
+
+
+def _count_tokens_cached(model: str, text_hash: bytes, text: str) -> int:
+    """Count tokens for text, reusing a previous count for identical content"""
+    key = (model, text_hash)
+    count = _get_cached_count(key)
+    if count is not None:
+        return count
+    return _store_count(key, _count_ordinary_tokens(_get_encoding(model), text))
+
+
 class LLMProvider:
     """Base class for LLM providers"""
     
-    async def generate(self, prompt: str, model: Optional[str] = None, max_tokens: Optional[int] = None, temperature: float = 0.7) -> Dict[str, Any]:
+    async def generate(self, prompt: str, model: Optional[str] = None, max_tokens: Optional[int] = None, temperature: float = 0.7, system_prompt: Optional[str] = None, stream_queue: Optional[asyncio.Queue] = None) -> Dict[str, Any]:
+        """Generate text; when stream_queue is given, text deltas are put on it as they arrive"""
         raise NotImplementedError
     
     def count_tokens(self, text: str) -> int:
@@ -38,12 +115,15 @@ class OpenAIProvider(LLMProvider):
         "gpt-4o-mini": {"input": 0.15, "output": 0.6},
     }
     
+    # Model whose tokenizer is used for local token counting
+    ENCODING_MODEL = "gpt-3.5-turbo"
+    
     def __init__(self):
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable is required")
         self.client = AsyncOpenAI(api_key=api_key)
-        self.encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        self.encoding = _get_encoding(self.ENCODING_MODEL)
     
     async def generate(
         self,
@@ -51,7 +131,8 @@ class OpenAIProvider(LLMProvider):
         model: Optional[str] = None,
         max_tokens: Optional[int] = None,
         temperature: float = 0.7,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        stream_queue: Optional[asyncio.Queue] = None
     ) -> Dict[str, Any]:
         """Generate text using OpenAI API"""
         model = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
@@ -63,12 +144,16 @@ class OpenAIProvider(LLMProvider):
         messages.append({"role": "user", "content": prompt})
         
         try:
-            response = await self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-            )
+            async with _OPENAI_SEM:
+                if stream_queue is not None:
+                    return await self._generate_stream(messages, model, max_tokens, temperature, stream_queue)
+                
+                response = await self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
             
             content = response.choices[0].message.content
             input_tokens = response.usage.prompt_tokens
@@ -87,9 +172,47 @@ class OpenAIProvider(LLMProvider):
         except Exception as e:
             raise Exception(f"OpenAI API error: {str(e)}")
     
+    async def _generate_stream(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        stream_queue: asyncio.Queue
+    ) -> Dict[str, Any]:
+        """Stream a chat completion, forwarding deltas to stream_queue"""
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+        )
+        
+        parts = []
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                delta = chunk.choices[0].delta.content
+                parts.append(delta)
+                stream_queue.put_nowait(delta)
+        content = "".join(parts)
+        
+        # Streamed responses carry no usage block, so count tokens locally
+        input_tokens = sum(self.count_tokens(message["content"]) for message in messages)
+        output_tokens = self.count_tokens(content)
+        
+        return {
+            "content": content,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "cost": self.calculate_cost(input_tokens, output_tokens, model),
+            "model": model,
+        }
+    
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
-        return len(self.encoding.encode(text))
+        return _count_tokens_cached(self.ENCODING_MODEL, _text_hash(text), text)
     
     def calculate_cost(self, input_tokens: int, output_tokens: int, model: str) -> float:
         """Calculate cost in USD"""
@@ -110,6 +233,9 @@ class AnthropicProvider(LLMProvider):
         "claude-3-haiku-20240307": {"input": 0.25, "output": 1.25},
     }
     
+    # System prompts at least this long (estimated tokens) are marked for prompt caching
+    PROMPT_CACHE_MIN_TOKENS = 1024
+    
     def __init__(self):
         api_key = os.getenv("ANTHROPIC_API_KEY")
         if not api_key:
@@ -122,22 +248,40 @@ class AnthropicProvider(LLMProvider):
         model: Optional[str] = None,
         max_tokens: Optional[int] = None,
         temperature: float = 0.7,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        stream_queue: Optional[asyncio.Queue] = None
     ) -> Dict[str, Any]:
         """Generate text using Anthropic API"""
         model = model or os.getenv("ANTHROPIC_MODEL", "claude-3-haiku-20240307")
         max_tokens = max_tokens or int(os.getenv("ANTHROPIC_MAX_TOKENS", "2000"))
         
+        kwargs = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+        }
+        # Omit an unset system prompt entirely so identical requests stay byte-identical
+        if system_prompt:
+            if await self.acount_tokens(system_prompt) >= self.PROMPT_CACHE_MIN_TOKENS:
+                kwargs["system"] = [
+                    {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}
+                ]
+                kwargs["extra_headers"] = {"anthropic-beta": "prompt-caching-2024-07-31"}
+            else:
+                kwargs["system"] = system_prompt
+        
         try:
-            response = await self.client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                system=system_prompt or "",
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-            )
+            async with _ANTHROPIC_SEM:
+                if stream_queue is not None:
+                    async with self.client.messages.stream(**kwargs) as stream:
+                        async for delta in stream.text_stream:
+                            stream_queue.put_nowait(delta)
+                        response = await stream.get_final_message()
+                else:
+                    response = await self.client.messages.create(**kwargs)
             
             content = response.content[0].text
             input_tokens = response.usage.input_tokens
@@ -158,9 +302,26 @@ class AnthropicProvider(LLMProvider):
     
     def count_tokens(self, text: str) -> int:
         """Count tokens in text (approximation)"""
+        # Returns an exact count if acount_tokens has already seen this text
+        count = _get_cached_count(("anthropic", _text_hash(text)))
+        if count is not None:
+            return count
         # Rough approximation: 4 characters per token
         return len(text) // 4
     
+    async def acount_tokens(self, text: str) -> int:
+        """Count tokens in text using Anthropic's tokenizer"""
+        key = ("anthropic", _text_hash(text))
+        count = _get_cached_count(key)
+        if count is not None:
+            return count
+        try:
+            count = await self.client.count_tokens(text)
+        except Exception:
+            # Counting only informs the prompt-cache hint; never fail a request over it
+            return self.count_tokens(text)
+        return _store_count(key, count)
+    
     def calculate_cost(self, input_tokens: int, output_tokens: int, model: str) -> float:
         """Calculate cost in USD"""
         pricing = self.PRICING.get(model, self.PRICING["claude-3-haiku-20240307"])
@@ -177,6 +338,20 @@ class MockProvider(LLMProvider):
     - Always reports 0 tokens and 0 cost
     """
 
+    # Every response shares these fields; only content and model vary
+    _RESPONSE_TEMPLATE = {
+        "content": None,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "total_tokens": 0,
+        "cost": 0.0,
+        "model": None,
+    }
+    _CONTENT_HEADER = (
+        "MOCK LLM RESPONSE (no real model was called).\n\n"
+        "Prompt preview:\n"
+    )
+
     async def generate(
         self,
         prompt: str,
@@ -184,25 +359,32 @@ class MockProvider(LLMProvider):
         max_tokens: Optional[int] = None,
         temperature: float = 0.7,
         system_prompt: Optional[str] = None,
+        stream_queue: Optional[asyncio.Queue] = None,
+    ) -> Dict[str, Any]:
+        result = self.generate_sync(prompt, model, max_tokens, temperature, system_prompt)
+        if stream_queue is not None:
+            stream_queue.put_nowait(result["content"])
+        return result
+
+    def generate_sync(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        system_prompt: Optional[str] = None,
     ) -> Dict[str, Any]:
+        """Build the mock response without touching the event loop"""
         # Very simple deterministic behavior so pipelines still work
         combined_prompt = f"{system_prompt or ''}\n{prompt}".strip()
         # Truncate to avoid huge echoes
-        preview = combined_prompt[:1000]
-        content = (
-            "MOCK LLM RESPONSE (no real model was called).\n\n"
-            "Prompt preview:\n"
-            f"{preview}"
-        )
+        if len(combined_prompt) > 1000:
+            combined_prompt = combined_prompt[:1000]
 
-        return {
-            "content": content,
-            "input_tokens": 0,
-            "output_tokens": 0,
-            "total_tokens": 0,
-            "cost": 0.0,
-            "model": model or "mock-llm",
-        }
+        result = self._RESPONSE_TEMPLATE.copy()
+        result["content"] = self._CONTENT_HEADER + combined_prompt
+        result["model"] = model or "mock-llm"
+        return result
 
     def count_tokens(self, text: str) -> int:
         # Always 0 to keep cost/token accounting at zero
@@ -216,7 +398,13 @@ class MockProvider(LLMProvider):
 class LLMService:
     """Service to manage LLM providers"""
     
-    def __init__(self):
+    # Cached responses expire after a day
+    CACHE_TTL_SECONDS = 86400
+    
+    def __init__(self, cache_client=None):
+        # Optional async Redis client used for the response cache
+        self.cache_client = cache_client
+        self._inflight: Dict[str, asyncio.Task] = {}
         self.openai = None
         self.anthropic = None
         self.mock = MockProvider()
@@ -241,9 +429,20 @@ class LLMService:
         model: Optional[str] = None,
         max_tokens: Optional[int] = None,
         temperature: float = 0.7,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        cache: bool = False,
+        stream_queue: Optional[asyncio.Queue] = None
     ) -> Dict[str, Any]:
-        """Generate text using the specified provider"""
+        """Generate text using the specified provider
+
+        Deterministic calls (temperature 0) and calls with cache=True are
+        deduplicated while in flight and served from the response cache when a
+        cache client is configured.
+
+        When stream_queue is given, text deltas are put on it as they arrive,
+        followed by None once generation ends (successfully or not). Streamed
+        calls always go to the provider.
+        """
         # Replace template variables in prompt
         prompt = self._interpolate_template(prompt, {})
         
@@ -257,17 +456,82 @@ class LLMService:
                 # Fall back to zero-cost mock provider
                 provider = "mock"
         
+        if stream_queue is not None:
+            try:
+                return await self._generate_uncached(prompt, provider, model, max_tokens, temperature, system_prompt, stream_queue)
+            finally:
+                stream_queue.put_nowait(None)
+        
+        if not (cache or temperature == 0):
+            return await self._generate_uncached(prompt, provider, model, max_tokens, temperature, system_prompt)
+        
+        # Identical idempotent calls already in flight share one upstream request
+        cache_key = self._cache_key(prompt, provider, model, max_tokens, temperature, system_prompt)
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.create_task(
+                self._generate_cached(cache_key, prompt, provider, model, max_tokens, temperature, system_prompt)
+            )
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        
+        # Shield so one caller being cancelled does not cancel the request for the others
+        return dict(await asyncio.shield(task))
+    
+    async def _generate_cached(
+        self,
+        cache_key: str,
+        prompt: str,
+        provider: str,
+        model: Optional[str],
+        max_tokens: Optional[int],
+        temperature: float,
+        system_prompt: Optional[str]
+    ) -> Dict[str, Any]:
+        """Generate through the response cache, if one is configured"""
+        if self.cache_client is None:
+            return await self._generate_uncached(prompt, provider, model, max_tokens, temperature, system_prompt)
+        
+        try:
+            cached = await self.cache_client.get(cache_key)
+        except Exception:
+            cached = None
+        if cached:
+            result = json.loads(cached)
+            result["cost"] = 0.0
+            result["cached"] = True
+            return result
+        
+        result = await self._generate_uncached(prompt, provider, model, max_tokens, temperature, system_prompt)
+        try:
+            await self.cache_client.set(cache_key, json.dumps(result), ex=self.CACHE_TTL_SECONDS)
+        except Exception:
+            # Cache is best-effort; a failed write must not fail the call
+            pass
+        return result
+    
+    async def _generate_uncached(
+        self,
+        prompt: str,
+        provider: str,
+        model: Optional[str],
+        max_tokens: Optional[int],
+        temperature: float,
+        system_prompt: Optional[str],
+        stream_queue: Optional[asyncio.Queue] = None
+    ) -> Dict[str, Any]:
+        """Dispatch a generate call to a concrete provider"""
         if provider == "openai":
             if not self.openai:
                 raise ValueError("OpenAI provider not initialized")
-            return await self.openai.generate(prompt, model, max_tokens, temperature, system_prompt)
+            return await self.openai.generate(prompt, model, max_tokens, temperature, system_prompt, stream_queue)
         elif provider == "anthropic":
             if not self.anthropic:
                 raise ValueError("Anthropic provider not initialized")
-            return await self.anthropic.generate(prompt, model, max_tokens, temperature, system_prompt)
+            return await self.anthropic.generate(prompt, model, max_tokens, temperature, system_prompt, stream_queue)
         elif provider == "mock":
             # Always available, zero-cost local provider
-            return await self.mock.generate(prompt, model, max_tokens, temperature, system_prompt)
+            return await self.mock.generate(prompt, model, max_tokens, temperature, system_prompt, stream_queue)
         else:
             raise ValueError(f"Unknown provider: {provider}")
     
@@ -277,11 +541,230 @@ class LLMService:
             var = match.group(1).strip()
             # Try to get value from context, handling nested keys with dot notation
             value = context
-            for key in var.split("."):
+            for key in _split_path(var):
                 if isinstance(value, dict) and key in value:
                     value = value[key]
                 else:
                     return match.group(0)  # Return original if not found
             return str(value) if value is not None else ""
         
-        return re.sub(r'\{\{([^}]+)\}\}', replace_var, template)
+        return _TEMPLATE_RE.sub(replace_var, template)
+    
+    @staticmethod
+    def _cache_key(
+        prompt: str,
+        provider: str,
+        model: Optional[str],
+        max_tokens: Optional[int],
+        temperature: float,
+        system_prompt: Optional[str]
+    ) -> str:
+        raw = f"{provider}|{model}|{max_tokens}|{temperature}|{system_prompt}|{prompt}"
+        return "llm:" + hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+@lru_cache()
+def get_llm_service(cache_client=None) -> LLMService:
+    """Return the process-wide LLMService so provider clients are built only once"""
+    return LLMService(cache_client)
+
+
+class BatchingLLMService:
+    """Coalesces concurrent generate calls into a single labeled batch prompt
+
+    Requests sharing the same (scope, provider, model, system_prompt, temperature)
+    that arrive within a short window are sent upstream as one prompt, so the
+    system prompt is paid for once per batch instead of once per request. The
+    scope (a run id) keeps one run's prompts out of another run's LLM context.
+    """
+
+    BATCH_INSTRUCTIONS = "Answer each query. Output as [1]...\n[2]...\n\n"
+    ANSWER_PATTERN = re.compile(r'\[(\d+)\]\s*(.*?)(?=\n\[\d+\]|\Z)', re.DOTALL)
+
+    def __init__(
+        self,
+        llm_service: LLMService,
+        max_batch: Optional[int] = None,
+        max_wait_ms: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
+        max_output_tokens: Optional[int] = None,
+    ):
+        self.llm_service = llm_service
+        self.max_batch = max_batch or int(os.getenv("LLM_BATCH_MAX_SIZE", "8"))
+        self.max_wait = (max_wait_ms or int(os.getenv("LLM_BATCH_MAX_WAIT_MS", "20"))) / 1000
+        self.max_batch_tokens = max_batch_tokens or int(os.getenv("LLM_BATCH_MAX_TOKENS", "6000"))
+        # Output budget of one batched call; must stay within the model's output limit
+        self.max_output_tokens = max_output_tokens or int(os.getenv("LLM_BATCH_MAX_OUTPUT_TOKENS", "4096"))
+        # Per-answer budget when the caller leaves max_tokens unset, matching the provider default
+        self.default_item_tokens = int(os.getenv("LLM_BATCH_ITEM_MAX_TOKENS", "2000"))
+        self._queues: Dict[Tuple, asyncio.Queue] = {}
+        # Strong references so background drain/dispatch tasks are not garbage collected mid-flight
+        self._tasks: set = set()
+
+    async def generate(
+        self,
+        prompt: str,
+        provider: str = "auto",
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        temperature: float = 0.7,
+        system_prompt: Optional[str] = None,
+        cache: bool = False,
+        scope: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Generate text, batching with concurrent requests for the same key and scope"""
+        # Prompts that would blow the budget on their own, or answers too long to share an
+        # output budget, are never batched
+        if (
+            self._estimate_tokens(prompt) > self.max_batch_tokens
+            or self._max_items(max_tokens) < 2
+        ):
+            return await self.llm_service.generate(prompt, provider, model, max_tokens, temperature, system_prompt, cache)
+
+        key = (scope, provider, model, system_prompt, temperature, max_tokens, cache)
+        future = asyncio.get_running_loop().create_future()
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[key] = queue
+            self._spawn(self._drain(key, queue))
+        queue.put_nowait((prompt, future))
+
+        return await future
+
+    def _max_items(self, max_tokens: Optional[int]) -> int:
+        """Largest batch whose answers all fit in one call's output budget"""
+        return min(self.max_batch, self.max_output_tokens // (max_tokens or self.default_item_tokens))
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """Start a background task and keep a reference to it until it finishes"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _drain(self, key: Tuple, queue: asyncio.Queue):
+        """Collect queued requests into batches until the queue runs dry"""
+        loop = asyncio.get_running_loop()
+        max_items = self._max_items(key[5])
+        carry = None
+        batch: List[Tuple[str, asyncio.Future]] = []
+
+        try:
+            while True:
+                batch = [carry or queue.get_nowait()]
+                carry = None
+                batch_tokens = self._estimate_tokens(batch[0][0])
+                deadline = loop.time() + self.max_wait
+
+                while len(batch) < max_items:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    item_tokens = self._estimate_tokens(item[0])
+                    if batch_tokens + item_tokens > self.max_batch_tokens:
+                        carry = item
+                        break
+                    batch.append(item)
+                    batch_tokens += item_tokens
+
+                self._spawn(self._dispatch(key, batch))
+                batch = []
+
+                if carry is None and queue.empty():
+                    # No await between this check and the removal, so no request can slip in
+                    del self._queues[key]
+                    return
+        except asyncio.CancelledError:
+            # Cancel every request still waiting here so its caller does not hang
+            self._queues.pop(key, None)
+            if carry is not None:
+                batch.append(carry)
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            for _, future in batch:
+                future.cancel()
+            raise
+
+    async def _dispatch(self, key: Tuple, batch: List[Tuple[str, asyncio.Future]]):
+        """Send a batch upstream and resolve each caller's future"""
+        _, provider, model, system_prompt, temperature, max_tokens, cache = key
+
+        def generate_one(prompt: str):
+            return self.llm_service.generate(prompt, provider, model, max_tokens, temperature, system_prompt, cache)
+
+        if len(batch) == 1:
+            prompt, future = batch[0]
+            await self._resolve(future, generate_one(prompt))
+            return
+
+        batch_prompt = self.BATCH_INSTRUCTIONS + "\n".join(
+            f"[{idx}] {prompt}" for idx, (prompt, _) in enumerate(batch, start=1)
+        )
+
+        try:
+            result = await self.llm_service.generate(
+                batch_prompt,
+                provider,
+                model,
+                # Each answer gets the budget it would have had alone; _max_items keeps this under the cap
+                min((max_tokens or self.default_item_tokens) * len(batch), self.max_output_tokens),
+                temperature,
+                system_prompt,
+                cache,
+            )
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception:
+            # A failed batch says nothing about the individual requests; retry each on its own
+            for prompt, future in batch:
+                if not future.done():
+                    self._spawn(self._resolve(future, generate_one(prompt)))
+            return
+
+        answers = {int(idx): answer.strip() for idx, answer in self.ANSWER_PATTERN.findall(result.get("content") or "")}
+        size = len(batch)
+
+        for idx, (prompt, future) in enumerate(batch, start=1):
+            if future.done():
+                continue
+            if idx not in answers:
+                # Model skipped this query; fall back to an individual request
+                self._spawn(self._resolve(future, generate_one(prompt)))
+                continue
+            future.set_result({
+                "content": answers[idx],
+                "input_tokens": result.get("input_tokens", 0) // size,
+                "output_tokens": result.get("output_tokens", 0) // size,
+                "total_tokens": result.get("total_tokens", 0) // size,
+                "cost": result.get("cost", 0.0) / size,
+                "model": result.get("model", model),
+                "batch_size": size,
+            })
+
+    @staticmethod
+    async def _resolve(future: asyncio.Future, coro):
+        """Await a coroutine and forward its outcome to a future"""
+        try:
+            result = await coro
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        # Rough approximation: 4 characters per token
+        return len(text) // 4
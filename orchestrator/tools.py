@@ -4,30 +4,192 @@ Includes web search, competitor analysis, and other tools
 """
 
 import os
-import json
+import orjson
 import re
-from typing import Dict, Any, List, Optional
+import time
+import asyncio
+import hashlib
+import logging
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Any, List, Optional, Tuple
 import httpx
-from tavily import TavilyClient
+
+logger = logging.getLogger(__name__)
+
+
+def _dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+    """Serialize to a JSON string with orjson, mirroring json.dumps' indent/sort_keys"""
+    option = orjson.OPT_INDENT_2 if indent else 0
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, option=option, default=str).decode()
+
+
+_loads = orjson.loads
+
+_TEMPLATE_RE = re.compile(r'\{\{([^}]+)\}\}')
+
+def _match_brace(text: str, start: int) -> int:
+    """Return the index of the brace closing the object opened at start, or -1"""
+    depth = 0
+    in_string = False
+    escaped = False
+    for idx in range(start, len(text)):
+        ch = text[idx]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return idx
+    return -1
+
+
+def _skip_whitespace(text: str, idx: int) -> int:
+    while idx < len(text) and text[idx].isspace():
+        idx += 1
+    return idx
+
+
+def _extract_fenced_json(content: str) -> Optional[str]:
+    """Return the first JSON object wrapped in a ``` (or ```json) code fence, if any"""
+    fence = content.find("```")
+    while fence != -1:
+        start = fence + 3
+        if content.startswith("json", start):
+            start += 4
+        start = _skip_whitespace(content, start)
+        if content.startswith("{", start):
+            end = _match_brace(content, start)
+            if end != -1 and content.startswith("```", _skip_whitespace(content, end + 1)):
+                return content[start:end + 1]
+        fence = content.find("```", fence + 3)
+    return None
+
+
+TAVILY_SEARCH_URL = "https://api.tavily.com/search"
+
+# Shared keep-alive pool for tool HTTP calls, created on first use
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+_HTTP_CLIENT_LOCK = asyncio.Lock()
+
+
+async def _get_http_client() -> httpx.AsyncClient:
+    """Return the shared tool HTTP client, creating it on first use"""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        async with _HTTP_CLIENT_LOCK:
+            if _HTTP_CLIENT is None:
+                _HTTP_CLIENT = httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                )
+    return _HTTP_CLIENT
+
+
+# TTL cache for informational (read-only) tool results: key -> (stored_at, value)
+_CACHE: Dict[str, tuple] = {}
+_CACHE_TTL_SECONDS = float(os.getenv("TOOL_CACHE_TTL_SECONDS", "300"))
+_CACHE_MAX_ENTRIES = 1024
+
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    entry = _CACHE.get(key)
+    if entry is None:
+        return None
+    if time.monotonic() - entry[0] >= _CACHE_TTL_SECONDS:
+        _CACHE.pop(key, None)
+        return None
+    return dict(entry[1])
+
+
+def _cache_set(key: str, value: Dict[str, Any]):
+    _CACHE.pop(key, None)
+    _CACHE[key] = (time.monotonic(), value)
+    if len(_CACHE) > _CACHE_MAX_ENTRIES:
+        # Dicts keep insertion order, so the first key is the oldest entry
+        _CACHE.pop(next(iter(_CACHE)))
+
+
+async def close_http_client():
+    """Close the shared tool HTTP client (called on orchestrator shutdown)"""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+
+
+@lru_cache(maxsize=1024)
+def _compile_template(template: str) -> Tuple[str, Tuple[Tuple[str, Tuple[str, ...]], ...]]:
+    """Split a template once into a str.format string and the placeholders it references"""
+    pieces = _TEMPLATE_RE.split(template)
+    # Literal text is brace-escaped so prompts containing JSON survive str.format
+    fmt = "{}".join(text.replace("{", "{{").replace("}", "}}") for text in pieces[0::2])
+    placeholders = tuple(
+        ("{{" + var + "}}", tuple(var.strip().split(".")))
+        for var in pieces[1::2]
+    )
+    return fmt, placeholders
+
+
+def _resolve_var(context: Dict[str, Any], raw: str, path: Tuple[str, ...]) -> str:
+    value = context
+    for key in path:
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        else:
+            return raw
+    return str(value) if value is not None else ""
+
+
+def _has_placeholder(value: Any) -> bool:
+    """Check whether any string nested in value contains a template placeholder"""
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            if "{{" in item:
+                return True
+        elif isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return False
+
+
+def _interpolate_template(template: str, context: Dict[str, Any]) -> str:
+    """Interpolate template variables like {{variable}}"""
+    # With no context every placeholder is left as-is, so there is nothing to substitute
+    if not context or "{{" not in template:
+        return template
+    fmt, placeholders = _compile_template(template)
+    return fmt.format(*[_resolve_var(context, raw, path) for raw, path in placeholders])
 
 
 class WebSearchTool:
     """Web search tool using Tavily API"""
     
     def __init__(self):
-        api_key = os.getenv("TAVILY_API_KEY")
-        if api_key:
-            self.client = TavilyClient(api_key=api_key)
-        else:
-            self.client = None
-            print("Warning: TAVILY_API_KEY not set. Web search will use fallback.")
+        self.api_key = os.getenv("TAVILY_API_KEY")
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        if not self.api_key:
+            logger.warning("TAVILY_API_KEY not set. Web search will use fallback.")
     
-    async def search(self, query: str, max_results: int = 5) -> Dict[str, Any]:
-        """Perform web search"""
+    async def search(self, query: str, max_results: int = 5, search_depth: str = "basic") -> Dict[str, Any]:
+        """Perform web search; search_depth is "basic" or the slower "advanced" mode"""
         # Interpolate template variables
-        query = self._interpolate_template(query, {})
+        query = _interpolate_template(query, {})
         
-        if not self.client:
+        if not self.api_key:
             # Fallback to basic search results
             return {
                 "results": [
@@ -41,77 +203,146 @@ class WebSearchTool:
                 "fallback": True,
             }
         
+        cached = _cache_get(f"ws:{max_results}:{search_depth}:{query}")
+        if cached is not None:
+            return cached
+        
+        # Identical searches already in flight share one upstream request
+        key = (query, max_results, search_depth)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._search_tavily(query, max_results, search_depth))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        # Shield so one caller being cancelled does not cancel the search for the others
+        return dict(await asyncio.shield(task))
+    
+    async def search_many(
+        self,
+        queries: List[str],
+        max_results: int = 5,
+        search_depth: str = "basic",
+        max_concurrency: int = 8,
+    ) -> List[Dict[str, Any]]:
+        """Run several searches concurrently, returning results in input order"""
+        # Cap concurrent upstream requests to stay within Tavily rate limits
+        sem = asyncio.Semaphore(max_concurrency)
+        
+        async def one(query: str) -> Dict[str, Any]:
+            async with sem:
+                return await self.search(query, max_results, search_depth)
+        
+        return await asyncio.gather(*[one(q) for q in queries])
+    
+    async def _search_tavily(self, query: str, max_results: int, search_depth: str) -> Dict[str, Any]:
+        """Run a search against the Tavily API"""
         try:
-            response = self.client.search(query=query, max_results=max_results, search_depth="advanced")
+            # Call the Tavily REST API directly so the request is awaited instead of blocking the loop
+            client = await _get_http_client()
+            response = await client.post(
+                TAVILY_SEARCH_URL,
+                json={
+                    "api_key": self.api_key,
+                    "query": query,
+                    "max_results": max_results,
+                    "search_depth": search_depth,
+                    "include_raw_content": False,
+                },
+                timeout=30.0,
+            )
+            response.raise_for_status()
+            data = response.json()
             
             results = []
-            for result in response.get("results", []):
+            sources = []
+            for result in data.get("results", []):
+                url = result.get("url", "")
                 results.append({
                     "title": result.get("title", ""),
-                    "url": result.get("url", ""),
+                    "url": url,
                     "content": result.get("content", ""),
                     "score": result.get("score", 0),
                 })
+                sources.append(url)
             
-            return {
+            result = {
                 "results": results,
                 "query": query,
-                "sources": [r["url"] for r in results],
+                "sources": sources,
             }
+            _cache_set(f"ws:{max_results}:{search_depth}:{query}", result)
+            return result
         except Exception as e:
             raise Exception(f"Web search error: {str(e)}")
-    
-    def _interpolate_template(self, template: str, context: Dict[str, Any]) -> str:
-        """Interpolate template variables like {{variable}}"""
-        def replace_var(match):
-            var = match.group(1).strip()
-            value = context
-            for key in var.split("."):
-                if isinstance(value, dict) and key in value:
-                    value = value[key]
-                else:
-                    return match.group(0)
-            return str(value) if value is not None else ""
-        
-        return re.sub(r'\{\{([^}]+)\}\}', replace_var, template)
 
 
 class CompetitorAnalysisTool:
     """Competitor analysis tool"""
     
-    def __init__(self, web_search_tool: WebSearchTool, llm_service=None):
+    def __init__(self, web_search_tool: WebSearchTool, llm_service=None, deep: bool = False):
         self.web_search = web_search_tool
         self.llm_service = llm_service
+        # Descriptions are cut to 200 chars for the prompt, so "basic" snippets are usually enough
+        self.search_depth = "advanced" if deep else "basic"
     
     async def analyze(self, idea: str, search_results: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """Analyze competitors for a given idea"""
-        idea = self._interpolate_template(idea, {})
+        """Analyze competitors for a given idea, reusing a recent analysis of the same inputs"""
+        idea = _interpolate_template(idea, {})
         
+        if search_results is None:
+            cache_key = f"ca:{idea}:search:{self.search_depth}"
+        else:
+            digest = hashlib.sha1(_dumps(search_results, sort_keys=True).encode()).hexdigest()
+            cache_key = f"ca:{idea}:{digest}"
+        
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
+        result = await self._analyze(idea, search_results)
+        # A result that fell back after the LLM call failed is degraded; retry the LLM next time
+        if result["llm_enhanced"] or not (self.llm_service and result["competitors"]):
+            _cache_set(cache_key, result)
+        return result
+    
+    async def analyze_many(self, ideas: List[str]) -> List[Dict[str, Any]]:
+        """Analyze several ideas concurrently, returning results in input order"""
+        return await asyncio.gather(*[self.analyze(idea) for idea in ideas])
+    
+    async def _analyze(self, idea: str, search_results: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Analyze competitors for a given idea"""
         # If search results provided, use them; otherwise perform search
         if search_results is None:
             search_query = f"{idea} competitors alternatives market analysis"
-            search_results = await self.web_search.search(search_query, max_results=10)
+            search_results = await self.web_search.search(search_query, max_results=10, search_depth=self.search_depth)
         
         # Extract competitor information from search results
+        # islice walks the first five results without copying them into a new list
+        results = search_results.get("results") or ()
+        sources = [r["url"] for r in islice(results, 5) if r.get("url")]
         competitors = []
-        sources = []
+        seen = set()
         
-        for result in search_results.get("results", [])[:5]:
+        for result in islice(results, 5):
             title = result.get("title", "")
+            if not title:
+                continue
             content = result.get("content", "")
             url = result.get("url", "")
             
             # Extract potential competitor names from title/content
             # This is a simple heuristic - in production, use LLM to extract structured data
-            competitor_name = title.split("-")[0].strip() if "-" in title else title[:50]
+            head, sep, _ = title.partition("-")
+            competitor_name = head.strip() if sep else title[:50]
             
-            if competitor_name and competitor_name not in [c["name"] for c in competitors]:
+            if competitor_name and competitor_name not in seen:
+                seen.add(competitor_name)
                 competitors.append({
                     "name": competitor_name,
-                    "description": content[:200] if content else "",
+                    "description": content or "",
                     "source": url,
                 })
-                sources.append(url)
         
         # If LLM service available, use it to refine analysis
         if self.llm_service and competitors:
@@ -121,7 +352,7 @@ class CompetitorAnalysisTool:
 Idea: {idea}
 
 Competitors found:
-{json.dumps(competitors, indent=2)}
+{_dumps([{**c, "description": c["description"][:200]} for c in competitors], indent=True)}
 
 Provide a structured competitor analysis with:
 1. Direct competitors (products solving the same problem)
@@ -142,9 +373,9 @@ Format the response as JSON with competitors array and analysis."""
                 content = llm_result.get("content", "")
                 try:
                     # Extract JSON from markdown code blocks if present
-                    json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', content, re.DOTALL)
-                    if json_match:
-                        analysis_data = json.loads(json_match.group(1))
+                    json_block = _extract_fenced_json(content)
+                    if json_block is not None:
+                        analysis_data = _loads(json_block)
                         return {
                             "idea": idea,
                             "competitors": analysis_data.get("competitors", competitors),
@@ -152,7 +383,7 @@ Format the response as JSON with competitors array and analysis."""
                             "sources": sources,
                             "llm_enhanced": True,
                         }
-                except:
+                except orjson.JSONDecodeError:
                     pass
                 
                 return {
@@ -163,7 +394,7 @@ Format the response as JSON with competitors array and analysis."""
                     "llm_enhanced": True,
                 }
             except Exception as e:
-                print(f"Warning: LLM competitor analysis failed: {e}")
+                logger.warning("LLM competitor analysis failed: %s", e)
         
         return {
             "idea": idea,
@@ -171,20 +402,6 @@ Format the response as JSON with competitors array and analysis."""
             "sources": sources,
             "llm_enhanced": False,
         }
-    
-    def _interpolate_template(self, template: str, context: Dict[str, Any]) -> str:
-        """Interpolate template variables like {{variable}}"""
-        def replace_var(match):
-            var = match.group(1).strip()
-            value = context
-            for key in var.split("."):
-                if isinstance(value, dict) and key in value:
-                    value = value[key]
-                else:
-                    return match.group(0)
-            return str(value) if value is not None else ""
-        
-        return re.sub(r'\{\{([^}]+)\}\}', replace_var, template)
 
 
 class ToolRegistry:
@@ -194,65 +411,77 @@ class ToolRegistry:
         self.web_search = WebSearchTool()
         self.competitor_analysis = CompetitorAnalysisTool(self.web_search, llm_service)
         self.llm_service = llm_service
+        self._dispatch = {
+            "web_search": self._run_web_search,
+            "competitor_analysis": self._run_competitor_analysis,
+        }
     
     async def execute_tool(self, tool_name: str, config: Dict[str, Any], inputs: Dict[str, Any]) -> Dict[str, Any]:
         """Execute a tool by name"""
-        # Interpolate config values with inputs
-        interpolated_config = self._interpolate_dict(config, inputs)
-        
-        if tool_name == "web_search":
-            query = interpolated_config.get("query", "")
-            max_results = interpolated_config.get("max_results", 5)
-            result = await self.web_search.search(query, max_results)
-            return {
-                "result": result,
-                "query": query,
-                "sources": result.get("sources", []),
-            }
-        
-        elif tool_name == "competitor_analysis":
-            idea = interpolated_config.get("idea", "")
-            search_results = interpolated_config.get("searchResults")
-            # If searchResults is a string, try to parse it
-            if isinstance(search_results, str):
-                try:
-                    search_results = json.loads(search_results)
-                except:
-                    search_results = None
-            result = await self.competitor_analysis.analyze(idea, search_results)
-            return {
-                "result": result,
-                "competitors": result.get("competitors", []),
-                "analysis": result.get("analysis", ""),
-            }
-        
-        else:
+        handler = self._dispatch.get(tool_name)
+        if handler is None:
             raise ValueError(f"Unknown tool: {tool_name}")
+        
+        # Interpolate config values with inputs; nothing to substitute without inputs
+        interpolated_config = config if not inputs else self._interpolate_dict(config, inputs)
+        return await handler(interpolated_config)
+    
+    async def _run_web_search(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        """Run the web_search tool"""
+        query = config.get("query", "")
+        max_results = config.get("max_results", 5)
+        search_depth = config.get("search_depth", "basic")
+        result = await self.web_search.search(query, max_results, search_depth)
+        return {
+            "result": result,
+            "query": query,
+            "sources": result.get("sources", []),
+        }
+    
+    async def _run_competitor_analysis(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        """Run the competitor_analysis tool"""
+        idea = config.get("idea", "")
+        search_results = config.get("searchResults")
+        # If searchResults is a string, try to parse it
+        if isinstance(search_results, str):
+            try:
+                search_results = _loads(search_results)
+            except orjson.JSONDecodeError:
+                search_results = None
+        result = await self.competitor_analysis.analyze(idea, search_results)
+        return {
+            "result": result,
+            "competitors": result.get("competitors", []),
+            "analysis": result.get("analysis", ""),
+        }
     
     def _interpolate_dict(self, config: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
-        """Recursively interpolate template variables in a dict"""
+        """Interpolate template variables in a nested dict"""
+        if not _has_placeholder(config):
+            # Nothing to substitute, so hand back the original config
+            return config
+        # Iterative walk: each stack entry pairs a source dict with the output dict to fill
         result = {}
-        for key, value in config.items():
-            if isinstance(value, str):
-                result[key] = self._interpolate_template(value, context)
-            elif isinstance(value, dict):
-                result[key] = self._interpolate_dict(value, context)
-            elif isinstance(value, list):
-                result[key] = [self._interpolate_template(str(v), context) if isinstance(v, str) else v for v in value]
-            else:
-                result[key] = value
-        return result
-    
-    def _interpolate_template(self, template: str, context: Dict[str, Any]) -> str:
-        """Interpolate template variables like {{variable}}"""
-        def replace_var(match):
-            var = match.group(1).strip()
-            value = context
-            for key in var.split("."):
-                if isinstance(value, dict) and key in value:
-                    value = value[key]
+        stack = [(config, result)]
+        while stack:
+            src, dst = stack.pop()
+            for key, value in src.items():
+                if isinstance(value, str):
+                    # Most config strings have no placeholders; skip the call entirely for them
+                    dst[key] = _interpolate_template(value, context) if "{{" in value else value
+                elif isinstance(value, dict):
+                    if _has_placeholder(value):
+                        child = {}
+                        dst[key] = child
+                        stack.append((value, child))
+                    else:
+                        dst[key] = value
+                elif isinstance(value, list):
+                    if any(isinstance(v, str) and "{{" in v for v in value):
+                        dst[key] = [_interpolate_template(v, context) if isinstance(v, str) else v for v in value]
+                    else:
+                        # Nothing to substitute, so share the original list
+                        dst[key] = value
                 else:
-                    return match.group(0)
-            return str(value) if value is not None else ""
-        
-        return re.sub(r'\{\{([^}]+)\}\}', replace_var, template)
+                    dst[key] = value
+        return result